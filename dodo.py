@@ -1,9 +1,17 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+import functools
+import hashlib
+import os
+import shutil
 
 import docutils.core
+import docutils.frontend
 import docutils.io
 import mako.lookup
 import mako.template
+import pygments
 
 from hat import json
 from hat.doit import common
@@ -12,19 +20,21 @@ from hat.doit import common
 DOIT_CONFIG = common.init(default_tasks=['build'])
 
 build_dir = Path('build')
+cache_dir = Path('.cache')
 src_html_dir = Path('src_html')
 src_rst_dir = Path('src_rst')
 src_static_dir = Path('src_static')
 
 article_tmpl_path = src_html_dir / '_article.html'
+feed_tmpl_path = src_html_dir / '_feed.xml'
 feed_path = build_dir / 'index.xml'
 
-conf = json.decode_file(Path('conf.yaml'))
+conf_path = Path('conf.yaml')
 
 
 def task_clean_all():
     """Clean all"""
-    return {'actions': [(common.rm_rf, [build_dir])]}
+    return {'actions': [(common.rm_rf, [build_dir, cache_dir])]}
 
 
 def task_build():
@@ -38,7 +48,7 @@ def task_build():
 
 def task_pages():
     """Build pages"""
-    for page in conf['pages']:
+    for page in _get_conf()['pages']:
         dst_path = _get_page_dst_path(page)
 
         yield {'name': str(dst_path),
@@ -48,12 +58,9 @@ def task_pages():
 
 def task_articles():
     """Build articles"""
-    for article in conf['articles']:
-        dst_path = _get_article_dst_path(article)
-
-        yield {'name': str(dst_path),
-               'actions': [(_build_article, [article])],
-               'targets': [dst_path]}
+    return {'actions': [_build_articles],
+            'targets': [_get_article_dst_path(article)
+                        for article in _get_conf()['articles']]}
 
 
 def task_feed():
@@ -64,40 +71,76 @@ def task_feed():
 
 def task_static():
     """Copy static files"""
-    for src_path in src_static_dir.rglob('*'):
-        if src_path.is_dir():
-            continue
+    mappings = list(_get_static_mappings())
 
-        dst_path = build_dir / src_path.relative_to(src_static_dir)
+    return {'actions': [(_copy_static_all, [mappings])],
+            'targets': [dst for _, dst in mappings]}
 
-        yield {'name': str(dst_path),
-               'actions': [(common.mkdir_p, [dst_path.parent]),
-                           (common.cp_r, [src_path, dst_path])],
-               'targets': [dst_path]}
+
+def _copy_static_all(mappings):
+    for dst_dir in {os.path.dirname(dst) for _, dst in mappings}:
+        os.makedirs(dst_dir, exist_ok=True)
+
+    max_workers = min(32, (os.cpu_count() or 1) * 4)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for _ in executor.map(_copy_static,
+                              [src for src, _ in mappings],
+                              [dst for _, dst in mappings]):
+            pass
+
+
+def _copy_static(src, dst):
+    try:
+        os.unlink(dst)
+
+    except FileNotFoundError:
+        pass
+
+    try:
+        os.link(src, dst)
+
+    except OSError:
+        shutil.copy2(src, dst)
 
 
 def _build_page(page):
     src_path = src_html_dir / page['src']
     dst_path = _get_page_dst_path(page)
 
-    params = {'conf': conf,
+    params = {'conf': _get_conf(),
               'title': page['title'],
               'page': page['title'],
-              'root_prefix': '../' * _get_path_depth(build_dir, dst_path)}
+              'root_prefix': _get_root_prefix(page['src'])}
 
     _build_mako(src_path=src_path,
                 dst_path=dst_path,
                 params=params)
 
 
+def _build_articles():
+    articles = sorted(_get_conf()['articles'],
+                      key=lambda i: (src_rst_dir / i['src']).stat().st_size,
+                      reverse=True)
+
+    max_workers = min(len(articles), DOIT_CONFIG['num_process'])
+    if max_workers < 2:
+        for article in articles:
+            _build_article(article)
+        return
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for _ in executor.map(_build_article, articles):
+            pass
+
+
 def _build_article(article):
     src_path = src_rst_dir / article['src']
     dst_path = _get_article_dst_path(article)
 
-    params = {'conf': conf,
+    params = {'conf': _get_conf(),
               'title': article['title'],
               'page': 'Articles',
-              'root_prefix': '../' * _get_path_depth(build_dir, dst_path),
+              'root_prefix': _get_root_prefix(f"articles/{article['src']}"),
               'published': article.get('published'),
               'updated': article.get('updated'),
               'body': _build_rst(src_path, 'long')}
@@ -108,74 +151,150 @@ def _build_article(article):
 
 
 def _build_feed():
-    updated = max((article.get(key, '')
-                   for article in conf['articles']
-                   for key in ('published', 'updated')),
-                  default='')
-
-    with open(feed_path, 'w', encoding='utf-8') as f:
-        f.write(f'<?xml version="1.0" encoding="utf-8"?>\n'
-                f'<feed xmlns="http://www.w3.org/2005/Atom">\n'
-                f'<title>Bozo Kopic home page</title>\n'
-                f'<link href="{conf["link"]}"/>\n'
-                f'<link href="{feed_path.name}" rel="self"/>\n'
-                f'<id>urn:uuid:{conf["id"]}</id>\n'
-                f'<updated>{updated}</updated>\n'
-                f'<author>\n'
-                f'<name>{conf["author"]["name"]}</name>\n'
-                f'<email>{conf["author"]["email"]}</email>\n'
-                f'</author>\n')
-
-        for article in conf['articles']:
-            link = _get_article_dst_path(article).relative_to(build_dir)
-            content = _build_rst(src_rst_dir / article['src'], 'none')
-
-            f.write(f'<entry>\n'
-                    f'<title>{article["title"]}</title>\n'
-                    f'<link href="{conf["link"]}/{link}"/>\n'
-                    f'<id>urn:uuid:{article["id"]}</id>\n'
-                    f'<published>{article["published"]}</published>\n')
-            if 'updated' in article:
-                f.write(f'<updated>{article["updated"]}</updated>\n')
-            f.write(f'<content type="xhtml">\n{content}\n</content>\n'
-                    f'</entry>\n')
-
-        f.write('</feed>\n')
+    entries = []
+    for article in _get_conf()['articles']:
+        src_path = src_rst_dir / article['src']
+        dst_path = _get_article_dst_path(article)
+        entries.append({'article': article,
+                        'link': dst_path.relative_to(build_dir),
+                        'content': _build_rst(src_path, 'none')})
+
+    params = {'conf': _get_conf(),
+              'feed_name': feed_path.name,
+              'entries': entries}
+
+    _build_mako(src_path=feed_tmpl_path,
+                dst_path=feed_path,
+                params=params)
 
 
 def _build_mako(src_path, dst_path, params):
-    tmpl_lookup = mako.lookup.TemplateLookup(directories=[str(src_html_dir)],
-                                             input_encoding='utf-8')
-    tmpl_uri = tmpl_lookup.filename_to_uri(str(src_path))
-    tmpl = tmpl_lookup.get_template(tmpl_uri)
+    tmpl = _get_tmpl(str(src_path))
     output = tmpl.render(**params)
 
-    dst_path.parent.mkdir(parents=True, exist_ok=True)
-    dst_path.write_text(output)
+    _write_text(dst_path, output)
+
+
+def _write_text(path, text):
+    data = text.encode('utf-8')
+
+    try:
+        if path.read_bytes() == data:
+            return
+
+    except FileNotFoundError:
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+    tmp_path = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+
+    try:
+        tmp_path.write_bytes(data)
+
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+    os.replace(tmp_path, path)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_conf():
+    return json.decode_file(conf_path)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_tmpl_lookup():
+    return mako.lookup.TemplateLookup(
+        directories=[str(src_html_dir)],
+        input_encoding='utf-8',
+        filesystem_checks=False)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_tmpl(src_path):
+    tmpl_lookup = _get_tmpl_lookup()
+    tmpl_uri = tmpl_lookup.filename_to_uri(src_path)
+    return tmpl_lookup.get_template(tmpl_uri)
 
 
 def _build_rst(src_path, syntax_highlight):
-    _, pub = docutils.core.publish_programmatically(
+    src = src_path.read_bytes()
+
+    key = hashlib.blake2b(src)
+    key.update(_get_rst_cache_salt(syntax_highlight))
+    cache_path = cache_dir / 'rst' / key.hexdigest()
+
+    try:
+        return cache_path.read_text(encoding='utf-8')
+
+    except FileNotFoundError:
+        pass
+
+    pub = _get_rst_publisher(syntax_highlight)
+    pub.set_source(source=src.decode('utf-8'))
+    pub.set_destination()
+    pub.publish()
+    body = pub.writer.parts['html_body']
+
+    _write_text(cache_path, body)
+    return body
+
+
+@functools.lru_cache(maxsize=None)
+def _get_rst_publisher(syntax_highlight):
+    pub = docutils.core.Publisher(
         source_class=docutils.io.StringInput,
-        source=src_path.read_text(),
-        source_path=None,
-        destination_class=docutils.io.StringOutput,
-        destination=None,
-        destination_path=None,
-        reader=None,
-        reader_name='standalone',
-        parser=None,
-        parser_name='restructuredtext',
-        writer=None,
-        writer_name='html5_polyglot',
-        settings=None,
+        destination_class=docutils.io.StringOutput)
+    pub.set_components(reader_name='standalone',
+                       parser_name='restructuredtext',
+                       writer_name='html5_polyglot')
+    pub.process_programmatic_settings(
         settings_spec=None,
-        settings_overrides={'math_output': 'MathML',
-                            'syntax_highlight': syntax_highlight},
-        config_section=None,
-        enable_exit_status=False)
+        settings_overrides=_get_rst_settings(syntax_highlight),
+        config_section=None)
+
+    return pub
+
+
+@functools.lru_cache(maxsize=None)
+def _get_rst_cache_salt(syntax_highlight):
+    salt = hashlib.blake2b()
+    salt.update(docutils.__version__.encode('utf-8'))
+    salt.update(pygments.__version__.encode('utf-8'))
+    settings = sorted(_get_rst_settings(syntax_highlight).items())
+    salt.update(repr(settings).encode('utf-8'))
+
+    for path in docutils.frontend.OptionParser.get_standard_config_files():
+        salt.update(path.encode('utf-8'))
+
+        try:
+            salt.update(Path(path).read_bytes())
+
+        except OSError:
+            pass
+
+    return salt.digest()
+
+
+def _get_rst_settings(syntax_highlight):
+    return {'math_output': 'MathML',
+            'syntax_highlight': syntax_highlight}
+
+
+def _get_static_mappings():
+    for src in _scan_files(str(src_static_dir)):
+        dst = os.path.join(build_dir, os.path.relpath(src, src_static_dir))
+        yield src, dst
+
+
+def _scan_files(dir_path):
+    with os.scandir(dir_path) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                yield from _scan_files(entry.path)
 
-    return pub.writer.parts['html_body']
+            elif not entry.is_dir():
+                yield entry.path
 
 
 def _get_page_dst_path(page):
@@ -186,5 +305,5 @@ def _get_article_dst_path(article):
     return (build_dir / 'articles' / article['src']).with_suffix('.html')
 
 
-def _get_path_depth(parent_dir, path):
-    return len(path.relative_to(parent_dir).parents) - 1
+def _get_root_prefix(build_rel_path):
+    return '../' * build_rel_path.count('/')